@@ -15,6 +15,7 @@ log = logging.getLogger(__name__)
 def setup_routes(app):
     app.router.add_post(app["config"]["base_url"] + r"/{endpoint:(verify|download)}", handlers.verify)
     app.router.add_get(app["config"]["base_url"] + "/status/{job_id}", handlers.status)
+    app.router.add_get(app["config"]["base_url"] + "/results/{job_id}", handlers.results)
 
 
 def parse_args():
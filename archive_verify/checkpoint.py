@@ -0,0 +1,196 @@
+import fcntl
+import glob
+import json
+import logging
+import os
+
+# Share pre-configured workers log
+log = logging.getLogger('archive_verify.workers')
+
+CHECKPOINT_NAME = "verify_checkpoint.jsonl"
+LOCK_NAME = "verify_checkpoint.lock"
+
+
+class Checkpoint:
+    """
+    An append-only record of the progress of a verify job, kept in the download directory. It is
+    created once the archive has been downloaded. The first line identifies the archive and the job
+    that downloaded it, and every following line records an event: a later job resuming it, a file
+    being verified or the verification finishing. A job that is interrupted can then be resumed in
+    the same directory by a later job, without downloading the archive or verifying the recorded
+    files again.
+
+    The job working on a checkpoint holds a lock on a file next to it, which is released when the
+    job is done or its process dies, so that two jobs never work in the same directory. A job that
+    resumes a checkpoint links its own download directory name to the directory it works in, so
+    that its output can be found by its job id.
+    """
+    def __init__(self, path, archive_name, archive_pdc_description, job_id):
+        """
+        :param path: The path to the checkpoint file
+        :param archive_name: The name of the archive being verified
+        :param archive_pdc_description: The unique description that was used when uploading the
+        archive to PDC
+        :param job_id: The id of the rq job that created the download directory
+        """
+        self.path = path
+        self.archive_name = archive_name
+        self.archive_pdc_description = archive_pdc_description
+        self.job_id = job_id
+        self.job_ids = [job_id]
+        self.completed = False
+        self.verified = set()
+        self._lock_file = None
+
+    @property
+    def owner(self):
+        """
+        :returns The id of the job that most recently worked on the checkpoint
+        """
+        return self.job_ids[-1]
+
+    @classmethod
+    def create(cls, dest, archive_name, archive_pdc_description, job_id):
+        """
+        Starts a new checkpoint in the download directory dest, replacing any existing one.
+        """
+        os.makedirs(dest, exist_ok=True)
+        checkpoint = cls(
+            os.path.join(dest, CHECKPOINT_NAME), archive_name, archive_pdc_description, job_id)
+        checkpoint.lock()
+        with open(checkpoint.path, "w") as fh:
+            fh.write(json.dumps({
+                "archive": archive_name,
+                "description": archive_pdc_description,
+                "job_id": job_id}) + "\n")
+        return checkpoint
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads a checkpoint file. A truncated last line, e.g. from a worker being killed while
+        writing, is ignored.
+
+        :returns A Checkpoint, or None if the file could not be parsed
+        """
+        try:
+            with open(path) as fh:
+                header = json.loads(fh.readline())
+                checkpoint = cls(path, header["archive"], header["description"], header["job_id"])
+                for line in fh:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        break
+                    if event["event"] == "resumed":
+                        checkpoint.job_ids.append(event["job_id"])
+                    elif event["event"] == "verified":
+                        checkpoint.verified.add(event["path"])
+                    elif event["event"] == "completed":
+                        checkpoint.completed = True
+        except (OSError, ValueError, KeyError) as e:
+            log.warning(f"Ignoring unreadable checkpoint {path}: {e}")
+            return None
+        return checkpoint
+
+    @classmethod
+    def find(cls, dest_root, archive_name, archive_pdc_description, is_active=None):
+        """
+        Looks for an unfinished checkpoint of the same archive in the download directories that no
+        other job is working on, and locks it.
+
+        :param dest_root: The directory where archives are downloaded
+        :param is_active: An optional function that is given the id of the job that last worked on
+        a checkpoint and returns True if that job is still queued or running, in which case the
+        checkpoint is skipped
+        :returns The most recently updated matching Checkpoint, or None if there is none
+        """
+        pattern = os.path.join(dest_root, f"{glob.escape(archive_name)}_*", CHECKPOINT_NAME)
+        candidates = []
+        for path in glob.glob(pattern):
+            # links of resumed jobs point to directories that are already matched
+            if os.path.islink(os.path.dirname(path)):
+                continue
+            # the directory may be removed by a job finishing while we look
+            try:
+                candidates.append((os.path.getmtime(path), path))
+            except OSError:
+                continue
+
+        for _, path in sorted(candidates, reverse=True):
+            checkpoint = cls.load(path)
+            if checkpoint is None \
+                    or checkpoint.completed \
+                    or checkpoint.archive_name != archive_name \
+                    or checkpoint.archive_pdc_description != archive_pdc_description:
+                continue
+            if not checkpoint.lock():
+                log.info(f"Not resuming checkpoint {path}, it is locked by another job")
+                continue
+            # the lock is not enough if jobs on other nodes share the download directories
+            if is_active is not None and is_active(checkpoint.owner):
+                log.info(f"Not resuming checkpoint {path}, job {checkpoint.owner} is still active")
+                checkpoint.release()
+                continue
+            return checkpoint
+        return None
+
+    def lock(self):
+        """
+        Takes the lock on the checkpoint without waiting.
+
+        :returns True if the lock was taken, False if another process holds it or the checkpoint
+        has been removed
+        """
+        try:
+            lock_file = open(os.path.join(os.path.dirname(self.path), LOCK_NAME), "w")
+        except FileNotFoundError:
+            return False
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def release(self):
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def _append(self, event):
+        # flush each event so that it survives the worker process being killed
+        with open(self.path, "a") as fh:
+            fh.write(json.dumps(event) + "\n")
+
+    def _link_path(self, job_id):
+        dest = os.path.dirname(self.path)
+        return os.path.join(os.path.dirname(dest), f"{self.archive_name}_{job_id}")
+
+    def mark_resumed(self, job_id):
+        self.job_ids.append(job_id)
+        self._append({"event": "resumed", "job_id": job_id})
+        try:
+            os.symlink(os.path.basename(os.path.dirname(self.path)), self._link_path(job_id))
+        except OSError as e:
+            log.warning(f"Could not link the download directory of job {job_id}: {e}")
+
+    def remove_links(self):
+        """
+        Removes the links of the jobs that resumed the checkpoint, e.g. after the download
+        directory has been removed.
+        """
+        for job_id in self.job_ids[1:]:
+            try:
+                os.remove(self._link_path(job_id))
+            except FileNotFoundError:
+                pass
+
+    def mark_verified(self, path):
+        self.verified.add(path)
+        self._append({"event": "verified", "path": path})
+
+    def mark_completed(self):
+        self.completed = True
+        self._append({"event": "completed"})
@@ -1,15 +1,35 @@
+import asyncio
+import functools
+import glob
 import logging
 import os
 
 from aiohttp import web
 from rq import Queue
+from rq.job import JobStatus
 
 import archive_verify
 from archive_verify.workers import verify_archive
 import archive_verify.redis_client as redis_client
+from archive_verify import results as verify_results
 
 log = logging.getLogger(__name__)
 
+RESULTS_PAGE_SIZE = 1000
+RESULTS_MAX_PAGE_SIZE = 10000
+
+# defaults for long-polling the status endpoint, in seconds
+STATUS_MAX_WAIT = 30
+STATUS_POLL_INTERVAL = 1
+
+# the statuses after which a job will not change again
+TERMINAL_STATUSES = [
+    JobStatus.FINISHED,
+    JobStatus.FAILED,
+    JobStatus.STOPPED,
+    JobStatus.CANCELED
+]
+
 
 async def verify(request):
     """
@@ -73,18 +93,96 @@ async def verify(request):
     return web.json_response(response)
 
 
+def _status_etag(job_id, job_status):
+    """
+    :returns An entity tag that changes whenever the RQ status of the job changes
+    """
+    return f'"{job_id}-{getattr(job_status, "value", job_status)}"'
+
+
+def _fetch_job_status(q, job_id):
+    """
+    :returns A tuple of the job and its status, or (None, None) if there is no such job
+    """
+    job = q.fetch_job(job_id)
+    return (job, job.get_status()) if job is not None else (None, None)
+
+
+def _fetch_job_result(job):
+    """
+    :returns A tuple of the result and the exc_info of a finished job
+    """
+    return job.result, job.exc_info
+
+
+def _etag_matches(if_none_match, etag):
+    """
+    Compares an If-None-Match header to an entity tag, using the weak comparison of RFC 7232.
+
+    :param if_none_match: The value of the header, or None if it was not given
+    :returns True if any of the entity tags in the header, or "*", matches etag
+    """
+    if if_none_match is None:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == "*" or tag == etag:
+            return True
+    return False
+
+
 async def status(request):
     """
     Handler accepts a GET call with an URL parameter which corresponds to a previously 
     enqueued job. The endpoint will return with the current status of the requested job. 
 
+    While the job is pending or running, the response carries an ETag. A request with a matching
+    If-None-Match header gets an empty 304 response if the status has not changed. With the wait
+    parameter, the request is held until the status changes or the given number of seconds has
+    passed, so that clients do not need to poll in a tight loop.
+
     :param job_id: The UUID4 of a previsouly enqueued verify job
+    :param wait: (query) The maximum number of seconds to wait for the status to change
     :return A JSON containing the current status of a verify job. 
     """
     job_id = str(request.match_info['job_id'])
 
+    try:
+        wait = float(request.query.get("wait", 0))
+        if not wait >= 0:
+            raise ValueError(wait)
+    except ValueError:
+        return web.json_response(
+            {
+                "state": archive_verify.State.ERROR,
+                "msg": f"Invalid wait {request.query.get('wait')}, expected a number of seconds"
+            },
+            status=400
+        )
+    config = request.app["config"]
+    wait = min(wait, config.get("status_max_wait", STATUS_MAX_WAIT))
+    poll_interval = config.get("status_poll_interval", STATUS_POLL_INTERVAL)
+
     q = request.app['redis_q']
-    job = q.fetch_job(job_id)
+    # the Redis client is blocking, keep the lookups off the event loop while clients wait
+    loop = asyncio.get_running_loop()
+    job, job_status = await loop.run_in_executor(None, _fetch_job_status, q, job_id)
+
+    if job is not None:
+        etag = _status_etag(job_id, job_status)
+        # compare against the client's versions of the status, or the current one if it has none
+        awaited_etags = request.headers.get("If-None-Match", etag)
+        deadline = loop.time() + wait
+        while _etag_matches(awaited_etags, etag) \
+                and job_status not in TERMINAL_STATUSES \
+                and loop.time() < deadline:
+            await asyncio.sleep(min(poll_interval, deadline - loop.time()))
+            job, job_status = await loop.run_in_executor(None, _fetch_job_status, q, job_id)
+            if job is None:
+                break
+            etag = _status_etag(job_id, job_status)
 
     if job is None:
         return web.json_response(
@@ -95,37 +193,136 @@ async def status(request):
             status=400
         )
 
+    if job_status not in TERMINAL_STATUSES \
+            and _etag_matches(request.headers.get("If-None-Match"), etag):
+        return web.Response(status=304, headers={"ETag": etag})
+
     job_state = archive_verify.REDIS_STATES.get(
-        job.get_status(),
+        job_status,
         archive_verify.State.NONE)
     payload = {
         "state": job_state
     }
     code = 200
+    headers = {}
 
     if job_state in [
         archive_verify.State.DONE,
         archive_verify.State.ERROR
     ]:
         # this is the dict returned by the worker function
-        job_result = job.result
+        job_result, job_exc_info = await loop.run_in_executor(None, _fetch_job_result, job)
         job_result_state = job_result["state"]
         payload["state"] = job_result_state
         payload["msg"] = f"Job {job_id} has returned with result: {job_result['msg']}"
 
         if job_result_state == archive_verify.State.ERROR:
-            payload["debug"] = job.exc_info if job.exc_info else job_result
+            payload["debug"] = job_exc_info if job_exc_info else job_result
             code = 500
 
-        job.delete()
+        await loop.run_in_executor(None, job.delete)
     elif job_state == archive_verify.State.STARTED:
         payload["msg"] = f"Job {job_id} is currently running."
     else:
         payload["msg"] = f"Job {job_id} is {job_state}"
 
+    if job_status not in TERMINAL_STATUSES:
+        headers["ETag"] = etag
+
     return web.json_response(
         payload,
-        status=code
+        status=code,
+        headers=headers
+    )
+
+
+def _find_results_db(app, job_id):
+    """
+    Locates the indexed results database for a job. If the job is still in the queue, the output
+    path is taken from its result. Otherwise, the download directory named after the job is used.
+
+    :param app: The web application
+    :param job_id: The id of a previously enqueued verify job
+    :returns The path to the results database, or None if it could not be found
+    """
+    job = app['redis_q'].fetch_job(job_id)
+    job_result = job.result if job is not None else None
+    if isinstance(job_result, dict) and job_result.get("path"):
+        db_path = verify_results.results_db_path(os.path.dirname(job_result["path"]))
+        if os.path.exists(db_path):
+            return db_path
+
+    pattern = os.path.join(
+        app["config"]["verify_root_dir"],
+        f"*_{glob.escape(job_id)}",
+        verify_results.RESULTS_DB_NAME)
+    # a job that resumed a checkpoint links its directory name to the directory it worked in
+    matches = glob.glob(pattern)
+    return matches[0] if matches else None
+
+
+async def results(request):
+    """
+    Handler accepts a GET call with an URL parameter which corresponds to a previously
+    enqueued job. The endpoint will return a page of the verification results of the job,
+    together with the number of files per status. Results are only available as long as the
+    downloaded archive is kept, i.e. for failed verifications or download jobs.
+
+    :param job_id: The UUID4 of a previously enqueued verify job
+    :param status: (query) Only return files with this status, OK or FAILED
+    :param prefix: (query) Only return files whose path starts with this prefix
+    :param after: (query) Only return files whose path sorts after this, i.e. the "next" value
+    returned by a previous call
+    :param limit: (query) The maximum number of files to return
+    :return A JSON containing the per-status counts, the page of results and the cursor to
+    the next page
+    """
+    job_id = str(request.match_info['job_id'])
+    query = request.query
+
+    try:
+        limit = int(query.get("limit", RESULTS_PAGE_SIZE))
+        if limit < 1:
+            raise ValueError(limit)
+    except ValueError:
+        return web.json_response(
+            {
+                "state": archive_verify.State.ERROR,
+                "msg": f"Invalid limit {query.get('limit')}, expected a positive integer"
+            },
+            status=400
+        )
+    limit = min(limit, RESULTS_MAX_PAGE_SIZE)
+
+    # the lookup and the query do blocking io, keep them off the event loop
+    loop = asyncio.get_running_loop()
+    db_path = await loop.run_in_executor(None, _find_results_db, request.app, job_id)
+    if db_path is None:
+        return web.json_response(
+            {
+                "state": archive_verify.State.ERROR,
+                "msg": f"No verification results found for job {job_id}!"
+            },
+            status=404
+        )
+
+    counts, page, next_cursor = await loop.run_in_executor(
+        None,
+        functools.partial(
+            verify_results.query_results,
+            db_path,
+            status=query.get("status"),
+            prefix=query.get("prefix"),
+            after=query.get("after"),
+            limit=limit))
+
+    return web.json_response(
+        {
+            "job_id": job_id,
+            "counts": counts,
+            "results": page,
+            "next": next_cursor
+        }
     )
 
 
@@ -5,6 +5,8 @@ import re
 import shutil
 import subprocess
 
+from archive_verify.throttle import command_prefix
+
 # Share pre-configured workers log
 log = logging.getLogger('archive_verify.workers')
 
@@ -28,6 +30,7 @@ class PdcClient:
         self.dsmc_log_dir = config["dsmc_log_dir"]
         self.whitelisted_warnings = config["whitelisted_warnings"]
         self.dsmc_extra_args = config.get("dsmc_extra_args", {})
+        self.io_limits = config.get("io_limits", {})
         self.archive_name = archive_name
         self.archive_pdc_path = archive_pdc_path
         self.archive_pdc_description = archive_pdc_description
@@ -64,7 +67,7 @@ class PdcClient:
         """
         log.info(f"Download_from_pdc started for {self.archive_pdc_path}")
         cmd = f"export DSM_LOG={self.dsmc_log_dir} && " \
-              f"dsmc retr {self.archive_pdc_path}/ {self.dest()}/ {self.dsmc_args()}"
+              f"{command_prefix(self.io_limits)}dsmc retr {self.archive_pdc_path}/ {self.dest()}/ {self.dsmc_args()}"
 
         p = subprocess.Popen(
             cmd,
@@ -0,0 +1,144 @@
+import os
+import sqlite3
+import urllib.parse
+
+RESULTS_DB_NAME = "compare_md5sum.db"
+
+
+def results_db_path(output_dir):
+    """
+    :param output_dir: The directory where the verification output is written
+    :returns The path to the indexed results database in output_dir
+    """
+    return os.path.join(output_dir, RESULTS_DB_NAME)
+
+
+def parse_md5sum_line(line):
+    """
+    Parses a single line of output from `md5sum -c`, e.g. "./dir/file: OK". The status is
+    normalised to OK or FAILED, and anything md5sum adds after it, e.g. the "open or read" of a
+    missing file, is returned as the detail.
+
+    :param line: A line of md5sum output
+    :returns A tuple of (path, status, detail), or None if the line does not describe a file
+    """
+    line = line.rstrip("\n")
+    if not line or line.startswith("md5sum:"):
+        return None
+    path, sep, status = line.rpartition(": ")
+    if not sep or not status.startswith(("OK", "FAILED")):
+        return None
+    # md5sum prefixes lines with a backslash if the file name contains special characters
+    if path.startswith("\\"):
+        path = path[1:]
+    if path.startswith("./"):
+        path = path[2:]
+    status, _, detail = status.partition(" ")
+    if status not in ("OK", "FAILED"):
+        return None
+    return path, status, detail
+
+
+def index_md5sum_output(md5_output, db_path):
+    """
+    Streams the output from `md5sum -c` into a SQLite database indexed on path and status. Per-status
+    counts are stored alongside the results so that they can be reported without scanning the table.
+
+    :param md5_output: The path to the file containing the md5sum output
+    :param db_path: The path to the SQLite database that will be (re-)created
+    :returns A dict with the number of files per status
+    """
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            conn.execute(
+                "CREATE TABLE results "
+                "(path TEXT PRIMARY KEY, status TEXT NOT NULL, detail TEXT NOT NULL) WITHOUT ROWID")
+            conn.execute("CREATE TABLE counts (status TEXT PRIMARY KEY, n INTEGER NOT NULL)")
+            # file names are not necessarily valid UTF-8, and SQLite can only store valid text
+            with open(md5_output, errors="backslashreplace") as fh:
+                rows = filter(None, map(parse_md5sum_line, fh))
+                conn.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?)", rows)
+            conn.execute("CREATE INDEX results_status ON results (status, path)")
+            conn.execute(
+                "INSERT INTO counts SELECT status, COUNT(*) FROM results GROUP BY status")
+        return get_counts(conn)
+    finally:
+        conn.close()
+
+
+def get_counts(conn):
+    """
+    :param conn: An open connection to a results database
+    :returns A dict with the number of files per status
+    """
+    return dict(conn.execute("SELECT status, n FROM counts ORDER BY status"))
+
+
+def _prefix_upper_bound(prefix):
+    """
+    :returns The smallest string that sorts after every string starting with prefix, or None if
+    there is no such string
+    """
+    prefix = prefix.rstrip("\U0010ffff")
+    if not prefix:
+        return None
+    next_char = ord(prefix[-1]) + 1
+    # surrogates cannot be encoded as UTF-8, skip to the first code point after them
+    if 0xD800 <= next_char <= 0xDFFF:
+        next_char = 0xE000
+    return prefix[:-1] + chr(next_char)
+
+
+def query_results(db_path, status=None, prefix=None, after=None, limit=1000):
+    """
+    Fetches a page of results from a results database, ordered by path. Paging is done with a
+    cursor on the last returned path, so every page is an index range scan regardless of its offset.
+
+    :param db_path: The path to the SQLite results database
+    :param status: If given, only return results with this status, OK or FAILED
+    :param prefix: If given, only return results whose path starts with this prefix
+    :param after: If given, only return results whose path sorts after this path
+    :param limit: The maximum number of results to return
+    :returns A tuple of (counts, results, next) where results is a list of dicts and next is the
+    cursor to pass as `after` to get the following page, or None if there are no more results
+    """
+    clauses = []
+    params = []
+    if status:
+        clauses.append("status = ?")
+        params.append(status)
+    if prefix:
+        clauses.append("path >= ? AND substr(path, 1, length(?)) = ?")
+        params.extend([prefix, prefix, prefix])
+        # an upper bound limits the index range scan, the substr comparison alone would not
+        upper_bound = _prefix_upper_bound(prefix)
+        if upper_bound is not None:
+            clauses.append("path < ?")
+            params.append(upper_bound)
+    if after:
+        clauses.append("path > ?")
+        params.append(after)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+    # open read-only so that a missing database is not silently created
+    conn = sqlite3.connect(
+        f"file:{urllib.parse.quote(os.path.abspath(db_path))}?mode=ro", uri=True)
+    try:
+        counts = get_counts(conn)
+        cursor = conn.execute(
+            f"SELECT path, status, detail FROM results {where} ORDER BY path LIMIT ?",
+            params + [limit + 1])
+        rows = cursor.fetchall()
+    finally:
+        conn.close()
+
+    more = len(rows) > limit
+    results = [
+        {"path": path, "status": status, "detail": detail}
+        for path, status, detail in rows[:limit]]
+    next_cursor = results[-1]["path"] if more else None
+    return counts, results, next_cursor
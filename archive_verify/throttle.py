@@ -0,0 +1,132 @@
+import datetime
+import socket
+import time
+
+# The io_limits options are described in config/app.yaml
+
+
+def is_active(io_limits, now=None):
+    """
+    :param io_limits: A dict with the io_limits section of the config
+    :param now: The datetime to check, defaults to the current local time
+    :returns True if the io limits apply at the given time
+    """
+    active_hours = io_limits.get("active_hours")
+    if not active_hours:
+        return True
+    start, end = active_hours
+    hour = (now or datetime.datetime.now()).hour
+    if start <= end:
+        return start <= hour < end
+    # the window wraps around midnight
+    return hour >= start or hour < end
+
+
+def command_prefix(io_limits, now=None):
+    """
+    Builds a prefix for shell commands that lowers their io and cpu scheduling priority. The active
+    hours are only checked here, so the priority is kept for the lifetime of the command.
+
+    :param io_limits: A dict with the io_limits section of the config
+    :param now: The datetime to check the active hours against
+    :returns A string ending with a space that should be put in front of the command, or an
+    empty string if no priorities are configured or the limits do not currently apply
+    """
+    if not is_active(io_limits, now):
+        return ""
+    prefix = []
+    if io_limits.get("ionice_class") is not None:
+        prefix.append(f"ionice -c {io_limits['ionice_class']}")
+        if io_limits.get("ionice_level") is not None:
+            prefix.append(f"-n {io_limits['ionice_level']}")
+    if io_limits.get("nice") is not None:
+        prefix.append(f"nice -n {io_limits['nice']}")
+    return " ".join(prefix) + " " if prefix else ""
+
+
+class TokenBucket:
+    """
+    Limits the rate of a single process. Tokens are taken up front and the caller sleeps off any
+    deficit, so a call never waits longer than it takes to refill the bucket for that call.
+    """
+    def __init__(self, rate, burst=None, clock=time.monotonic, sleep=time.sleep):
+        """
+        :param rate: The number of tokens (bytes) added per second
+        :param burst: The maximum number of tokens that can accumulate, defaults to rate
+        """
+        self.rate = rate
+        self.burst = burst or rate
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = self.burst
+        self.timestamp = clock()
+
+    def consume(self, n):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.timestamp) * self.rate) - n
+        self.timestamp = now
+        if self.tokens < 0:
+            self.sleep(-self.tokens / self.rate)
+
+
+class RedisTokenBucket(TokenBucket):
+    """
+    A token bucket kept in Redis, so that the rate is shared by all workers using the same key.
+    """
+    def __init__(self, connection, key, rate, burst=None, clock=time.time, sleep=time.sleep):
+        """
+        :param connection: A Redis connection
+        :param key: The Redis key holding the state of the bucket
+        """
+        super().__init__(rate, burst, clock, sleep)
+        self.connection = connection
+        self.key = key
+
+    def consume(self, n):
+        def take(pipe):
+            tokens, timestamp = pipe.hmget(self.key, "tokens", "timestamp")
+            now = self.clock()
+            if tokens is None or timestamp is None:
+                tokens = self.burst
+            else:
+                tokens = min(self.burst, float(tokens) + (now - float(timestamp)) * self.rate)
+            tokens -= n
+            pipe.multi()
+            pipe.hset(self.key, mapping={"tokens": tokens, "timestamp": now})
+            pipe.expire(self.key, 3600)
+            return tokens
+
+        tokens = self.connection.transaction(take, self.key, value_from_callable=True)
+        if tokens < 0:
+            self.sleep(-tokens / self.rate)
+
+
+class Throttle:
+    """
+    Applies a set of token buckets to hashing reads during the configured active hours.
+    """
+    def __init__(self, io_limits, buckets):
+        self.io_limits = io_limits
+        self.buckets = buckets
+
+    def consume(self, n):
+        if is_active(self.io_limits):
+            for bucket in self.buckets:
+                bucket.consume(n)
+
+
+def throttle_from_config(io_limits, connection=None):
+    """
+    :param io_limits: A dict with the io_limits section of the config
+    :param connection: A Redis connection, required for node_bytes_per_sec
+    :returns A Throttle, or None if no read rates are configured
+    """
+    buckets = []
+    if io_limits.get("hash_bytes_per_sec"):
+        buckets.append(TokenBucket(io_limits["hash_bytes_per_sec"]))
+    if io_limits.get("node_bytes_per_sec"):
+        buckets.append(RedisTokenBucket(
+            connection,
+            f"archive_verify:io:{socket.gethostname()}",
+            io_limits["node_bytes_per_sec"]))
+    return Throttle(io_limits, buckets) if buckets else None
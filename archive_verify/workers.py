@@ -1,35 +1,184 @@
+import contextlib
+import copy
+import json
 import logging
+import logging.handlers
+import queue
+import re
 import rq
+import sqlite3
 import subprocess
 import os
 import datetime
+import hashlib
 
 import archive_verify
+from archive_verify import results
+from archive_verify.checkpoint import Checkpoint
+from archive_verify.throttle import command_prefix, throttle_from_config
 from archive_verify.pdc_client import PdcClient, MockPdcClient
 
 log = logging.getLogger(__name__)
 
+# "<md5>  <path>", or "<md5> *<path>" for files checksummed in binary mode
+CHECKSUM_LINE = re.compile(r"^[0-9a-fA-F]{32} [ *].")
 
-def compare_md5sum(archive_dir):
+
+def compare_md5sum(archive_dir, checkpoint=None, throttle=None, cmd_prefix=""):
     """
     Calculates the MD5 sums of the specified archive and compares them to the previously generated checksums 
     that were uploaded together with the archive to PDC. 
 
+    If a checkpoint is given, files it records as verified are not hashed again, and every file that is
+    verified successfully is added to it as soon as md5sum reports it.
+
     :param archive_dir: The path to the archive that we shall verify
+    :param checkpoint: An optional Checkpoint of a previous, interrupted, verification
+    :param throttle: An optional Throttle limiting the read rate, in which case the files are hashed by
+    the worker instead of by md5sum
+    :param cmd_prefix: A prefix for the md5sum command, e.g. to lower its io priority
     :returns True if no errors or warnings were encountered when calculating checksums, otherwise False 
     """
     parent_dir = os.path.abspath(os.path.join(archive_dir, os.pardir))
     md5_output = os.path.join(parent_dir, "compare_md5sum.out")
-    cmd = "cd {} && md5sum -c ./{} > {}".format(archive_dir, "checksums_prior_to_pdc.md5", md5_output)
-    log.debug(f"Executing verification: {cmd}...")
-    p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    checksums = "checksums_prior_to_pdc.md5"
+    previously_verified = checkpoint.verified if checkpoint is not None else set()
+
+    # file names are not necessarily valid UTF-8, pass them through unchanged
+    with open(md5_output, "w", errors="surrogateescape") as out:
+        remaining = None
+        if previously_verified:
+            log.info(f"Resuming verification, skipping {len(previously_verified)} verified file(s)")
+            checksums = os.path.join(parent_dir, "checksums_remaining.md5")
+            remaining = _write_remaining_checksums(
+                os.path.join(archive_dir, "checksums_prior_to_pdc.md5"),
+                checksums,
+                previously_verified,
+                out)
+
+        if remaining == 0:
+            # md5sum fails on a checksums file without entries
+            log.info("All files were verified before the verification was interrupted")
+            p = None
+            lines = []
+        elif throttle is None:
+            cmd = "cd {} && {}md5sum -c {}".format(
+                archive_dir, cmd_prefix, checksums if previously_verified else f"./{checksums}")
+            log.debug(f"Executing verification: {cmd}...")
+            p = subprocess.Popen(
+                cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                errors="surrogateescape")
+            lines = p.stdout
+        else:
+            log.debug(f"Executing throttled verification of {archive_dir}...")
+            p = None
+            lines = _md5sum_check(archive_dir, checksums, throttle)
+
+        all_ok = True
+        n_checked = 0
+        try:
+            try:
+                for line in lines:
+                    if line.startswith("md5sum:"):
+                        log.warning(line.rstrip())
+                        continue
+                    out.write(line)
+                    parsed = results.parse_md5sum_line(line)
+                    if parsed is not None:
+                        n_checked += 1
+                    if parsed is not None and parsed[1] != "OK":
+                        all_ok = False
+                    if checkpoint is not None and parsed is not None and parsed[1] == "OK":
+                        out.flush()
+                        checkpoint.mark_verified(parsed[0])
+            except OSError as e:
+                log.error(f"Could not read checksums for {archive_dir}: {e}")
+                all_ok = False
+
+            if p is not None:
+                p.wait()
+                all_ok = p.returncode == 0
+            elif remaining != 0 and not n_checked:
+                # like md5sum, fail if the checksums file has no entries
+                all_ok = False
+        finally:
+            # do not leave md5sum hashing the archive if the output could not be handled
+            if p is not None and p.returncode is None:
+                p.kill()
+                p.wait()
+
+    # index the output so that it can be queried through the /results endpoint
+    try:
+        counts = results.index_md5sum_output(md5_output, results.results_db_path(parent_dir))
+        log.debug(f"Indexed verification results: {counts}")
+    except (OSError, sqlite3.Error) as e:
+        log.warning(f"Could not index verification results in {md5_output}: {e}")
+
+    return all_ok
+
+
+def _md5sum_check(archive_dir, checksums, throttle, chunk_size=4 * 1024 * 1024):
+    """
+    Checks the files in a checksums file like `md5sum -c`, but reading the files through a throttle.
+
+    :param archive_dir: The directory the paths in the checksums file are relative to
+    :param checksums: The path to the checksums file, relative to archive_dir or absolute
+    :param throttle: A Throttle limiting the read rate
+    :param chunk_size: The number of bytes to read at a time
+    :returns A generator of output lines in the same format as `md5sum -c`
+    """
+    n_checked = 0
+    n_improper = 0
+    with open(os.path.join(archive_dir, checksums), errors="surrogateescape") as fh:
+        for line in fh:
+            line = line.rstrip("\n")
+            escaped = line.startswith("\\")
+            if escaped:
+                line = line[1:]
+            if not CHECKSUM_LINE.match(line):
+                n_improper += 1
+                continue
+            expected, path = line[:32].lower(), line[34:]
+            name = re.sub(r"\\(.)", lambda m: "\n" if m.group(1) == "n" else m.group(1), path) \
+                if escaped else path
+            prefix = "\\" if escaped else ""
+            n_checked += 1
 
-    p.communicate()
+            md5 = hashlib.md5()
+            try:
+                with open(os.path.join(archive_dir, name), "rb") as f:
+                    for chunk in iter(lambda: f.read(chunk_size), b""):
+                        throttle.consume(len(chunk))
+                        md5.update(chunk)
+            except OSError as e:
+                yield f"md5sum: {path}: {e.strerror}\n"
+                yield f"{prefix}{path}: FAILED open or read\n"
+                continue
 
-    if p.returncode != 0: 
+            yield f"{prefix}{path}: {'OK' if md5.hexdigest() == expected else 'FAILED'}\n"
+
+    if n_improper:
+        yield f"md5sum: WARNING: {n_improper} line(s) improperly formatted\n"
+    if not n_checked:
+        yield f"md5sum: {checksums}: no properly formatted MD5 checksum lines found\n"
+
+
+def _job_is_active(job_id, connection):
+    """
+    :param job_id: The id of an rq job
+    :param connection: The Redis connection of the queue
+    :returns True if the job is waiting to run or running
+    """
+    try:
+        job = rq.job.Job.fetch(job_id, connection=connection)
+    except rq.exceptions.NoSuchJobError:
         return False
-    else: 
-        return True
+    return job.get_status() in [
+        rq.job.JobStatus.QUEUED,
+        rq.job.JobStatus.DEFERRED,
+        rq.job.JobStatus.SCHEDULED,
+        rq.job.JobStatus.STARTED
+    ]
 
 
 def pdc_client_factory(config):
@@ -42,14 +191,113 @@ def pdc_client_factory(config):
     return MockPdcClient if config.get("pdc_client", "PdcClient") == "MockPdcClient" else PdcClient
 
 
-def configure_log(dsmc_log_dir, archive_pdc_description):
+def _write_remaining_checksums(checksums, remaining, verified, out):
+    """
+    Writes the entries in the checksums file that have not yet been verified to a new checksums
+    file, and the output md5sum gave for the already verified entries to out.
+
+    :param checksums: The path to the checksums file uploaded with the archive
+    :param remaining: The path to the checksums file that will be written
+    :param verified: A set of the paths that have already been verified
+    :param out: An open file where the md5sum output is written
+    :returns The number of entries written to the remaining checksums file
+    """
+    n_remaining = 0
+    with open(checksums, errors="surrogateescape") as src, \
+            open(remaining, "w", errors="surrogateescape") as dst:
+        for line in src:
+            # names with special characters are escaped, these are always verified again
+            if line.startswith("\\"):
+                dst.write(line)
+                n_remaining += 1
+                continue
+            # md5sum only warns about improperly formatted lines, leave them out
+            if not CHECKSUM_LINE.match(line):
+                continue
+            path = line.rstrip("\n")[34:]
+            name = path[2:] if path.startswith("./") else path
+            if name in verified:
+                out.write(f"{path}: OK\n")
+            else:
+                dst.write(line)
+                n_remaining += 1
+    return n_remaining
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats log records as one JSON object per line.
+    """
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "name": record.name,
+            "level": record.levelname,
+            "message": record.getMessage()
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+class BlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    A QueueHandler that waits for room in a bounded queue instead of failing when it is full,
+    so that no records are lost if the listener falls behind.
+    """
+    def enqueue(self, record):
+        self.queue.put(record)
+
+    def prepare(self, record):
+        # unlike QueueHandler.prepare, keep exc_info so that the formatter of the file handler
+        # decides how the exception is written, e.g. as a separate field in JSON output
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class BlockingQueueListener(logging.handlers.QueueListener):
+    """
+    A QueueListener that waits for room in a bounded queue for its stop sentinel.
+    """
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+@contextlib.contextmanager
+def configure_log(dsmc_log_dir, archive_pdc_description, log_format="text", queue_size=10000):
+    """
+    Directs the workers log to a job specific log file for the duration of the context. Records
+    are passed through a bounded queue and written to the file by a background listener thread,
+    which is stopped and the file closed when the context exits.
+
+    :param dsmc_log_dir: The directory where the log file will be written
+    :param archive_pdc_description: The unique description of the archive, used in the file name
+    :param log_format: "text" for plain log lines or "json" for one JSON object per line
+    :param queue_size: The maximum number of records buffered before logging blocks
+    """
     now_str = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M')
     log.setLevel(logging.DEBUG)
     fh = logging.FileHandler(os.path.join(dsmc_log_dir, "{}-{}.log".format(archive_pdc_description, now_str)))
     fh.setLevel(logging.DEBUG)
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if log_format == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     fh.setFormatter(formatter)
-    log.addHandler(fh)
+
+    qh = BlockingQueueHandler(queue.Queue(maxsize=queue_size))
+    qh.setLevel(logging.DEBUG)
+    listener = BlockingQueueListener(qh.queue, fh)
+    listener.start()
+    log.addHandler(qh)
+    try:
+        yield
+    finally:
+        log.removeHandler(qh)
+        listener.stop()
+        fh.close()
 
 
 def verify_archive(
@@ -71,48 +319,81 @@ def verify_archive(
     :returns A JSON with the result that will be kept in the Redis queue
     """
     dsmc_log_dir = config["dsmc_log_dir"]
-    configure_log(dsmc_log_dir, archive_pdc_description)
-    log.debug("verify_archive started for {}".format(archive_name))
+    with configure_log(
+            dsmc_log_dir,
+            archive_pdc_description,
+            log_format=config.get("job_log_format", "text"),
+            queue_size=config.get("job_log_queue_size", 10000)), \
+            contextlib.ExitStack() as resources:
+        log.debug("verify_archive started for {}".format(archive_name))
 
-    pdc_class = pdc_client_factory(config)
-    log.debug(f"Using PDC Client of type: {pdc_class.__name__}")
+        pdc_class = pdc_client_factory(config)
+        log.debug(f"Using PDC Client of type: {pdc_class.__name__}")
 
-    job_id = rq.get_current_job().id
-    pdc_client = pdc_class(
-        archive_name,
-        archive_pdc_path,
-        archive_pdc_description,
-        job_id,
-        config)
-    dest = pdc_client.dest()
-    download_ok = pdc_client.download()
-
-    if not download_ok:
-        log.debug("Download of {} failed.".format(archive_name))
-        return {
-            "state": archive_verify.State.ERROR,
-            "msg": "failed to properly download archive from pdc",
-            "path": dest
-        }
-    else:
-        log.debug("Verifying {}...".format(archive_name))
-        archive = pdc_client.downloaded_archive_path()
-        verified_ok = compare_md5sum(archive)
-        output_file = "{}/compare_md5sum.out".format(dest)
-
-        if verified_ok:
-            log.info("Verify of {} succeeded.".format(archive))
-            if not keep_downloaded_archive:
-                pdc_client.cleanup()
-            return {
-                "state": archive_verify.State.DONE,
-                "path": output_file,
-                "msg": "Successfully verified archive md5sums."
-            }
-        else:
-            log.info("Verify of {} failed.".format(archive))
+        current_job = rq.get_current_job()
+        job_id = current_job.id
+        resume = config.get("resume_from_checkpoint", False)
+        checkpoint = None
+        if resume:
+            checkpoint = Checkpoint.find(
+                config["verify_root_dir"],
+                archive_name,
+                archive_pdc_description,
+                is_active=lambda owner: owner != job_id and _job_is_active(owner, current_job.connection))
+        if checkpoint is not None:
+            # continue in the download directory of the interrupted job
+            log.info(f"Resuming verification of {archive_name} from checkpoint {checkpoint.path}")
+            checkpoint.mark_resumed(job_id)
+            resources.callback(checkpoint.release)
+            job_id = checkpoint.job_id
+
+        pdc_client = pdc_class(
+            archive_name,
+            archive_pdc_path,
+            archive_pdc_description,
+            job_id,
+            config)
+        dest = pdc_client.dest()
+        download_ok = checkpoint is not None or pdc_client.download()
+        if download_ok and resume and checkpoint is None:
+            checkpoint = Checkpoint.create(dest, archive_name, archive_pdc_description, job_id)
+            resources.callback(checkpoint.release)
+
+        if not download_ok:
+            log.debug("Download of {} failed.".format(archive_name))
             return {
                 "state": archive_verify.State.ERROR,
-                "path": output_file,
-                "msg": "Failed to verify archive md5sums."
+                "msg": "failed to properly download archive from pdc",
+                "path": dest
             }
+        else:
+            log.debug("Verifying {}...".format(archive_name))
+            archive = pdc_client.downloaded_archive_path()
+            io_limits = config.get("io_limits", {})
+            verified_ok = compare_md5sum(
+                archive,
+                checkpoint,
+                throttle=throttle_from_config(io_limits, current_job.connection),
+                cmd_prefix=command_prefix(io_limits))
+            output_file = "{}/compare_md5sum.out".format(dest)
+            if checkpoint is not None:
+                checkpoint.mark_completed()
+
+            if verified_ok:
+                log.info("Verify of {} succeeded.".format(archive))
+                if not keep_downloaded_archive:
+                    pdc_client.cleanup()
+                    if checkpoint is not None:
+                        checkpoint.remove_links()
+                return {
+                    "state": archive_verify.State.DONE,
+                    "path": output_file,
+                    "msg": "Successfully verified archive md5sums."
+                }
+            else:
+                log.info("Verify of {} failed.".format(archive))
+                return {
+                    "state": archive_verify.State.ERROR,
+                    "path": output_file,
+                    "msg": "Failed to verify archive md5sums."
+                }
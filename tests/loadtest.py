@@ -0,0 +1,242 @@
+"""
+Load-testing harness for the archive-verify REST API.
+
+Starts the aiohttp app in-process against fakeredis (or a local Redis given with --redis-url),
+replays a mix of requests at a configurable concurrency and reports throughput and latency
+percentiles per endpoint. No RQ worker is started, so enqueued jobs stay in the queue and the
+queue grows throughout the run. The enqueued jobs are deleted when the run ends.
+
+Requests are read from a JSONL trace with one request per line, e.g.:
+
+    {"method": "POST", "path": "/verify", "body": {"host": "h", "archive": "a", "description": "d"}}
+    {"method": "GET", "path": "/status/{job_id}"}
+
+Paths are relative to base_url and "{job_id}" is replaced by the id of a randomly chosen job
+enqueued earlier in the run. Without a trace, a synthetic mix of /verify and /status requests is
+generated.
+
+    python tests/loadtest.py -c tests/test_config.yaml --requests 5000 --concurrency 50
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import random
+import sys
+import time
+import yaml
+
+from aiohttp import ClientSession, web
+from aiohttp.test_utils import TestServer
+from redis import Redis
+
+import archive_verify.app as app_setup
+import mock_redis_client
+
+
+def load_trace(trace_file):
+    """
+    :param trace_file: The path to a JSONL file with one request per line
+    :returns A list of request dicts
+    """
+    with open(trace_file) as fh:
+        return [json.loads(line) for line in fh if line.strip()]
+
+
+def synthetic_trace(n, verify_ratio):
+    """
+    :param n: The number of requests to generate
+    :param verify_ratio: The fraction of requests that should be POSTs to /verify
+    :returns A list of request dicts
+    """
+    trace = []
+    for i in range(n):
+        if i == 0 or random.random() < verify_ratio:
+            trace.append({
+                "method": "POST",
+                "path": "/verify",
+                "body": {
+                    "host": "loadtest-host",
+                    "archive": f"loadtest_archive_{i}",
+                    "description": f"loadtest-description-{i}"}})
+        else:
+            trace.append({"method": "GET", "path": "/status/{job_id}"})
+    return trace
+
+
+def percentile(sorted_values, p):
+    """
+    Nearest-rank percentile.
+
+    :param sorted_values: A sorted list of values
+    :param p: The percentile, 0-100
+    :returns The value at the given percentile
+    """
+    if not sorted_values:
+        return float("nan")
+    rank = max(math.ceil(p / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies, statuses, elapsed):
+    """
+    :param latencies: A dict mapping endpoint to a list of request latencies in seconds
+    :param statuses: A dict mapping endpoint to a dict of HTTP status code counts
+    :param elapsed: The wall-clock duration of the run in seconds
+    :returns A dict with throughput and latency percentiles (in ms) per endpoint and in total
+    """
+    report = {}
+    all_latencies = list(itertools.chain.from_iterable(latencies.values()))
+    for endpoint, values in list(latencies.items()) + [("total", all_latencies)]:
+        values = sorted(values)
+        report[endpoint] = {
+            "requests": len(values),
+            "throughput": len(values) / elapsed if elapsed else float("nan"),
+            "p50_ms": percentile(values, 50) * 1000,
+            "p90_ms": percentile(values, 90) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            "max_ms": values[-1] * 1000 if values else float("nan"),
+            "statuses": statuses.get(endpoint, {}) if endpoint != "total" else {
+                code: sum(s.get(code, 0) for s in statuses.values())
+                for code in set(itertools.chain.from_iterable(statuses.values()))}
+        }
+    report["total"]["elapsed_s"] = elapsed
+    return report
+
+
+def create_app(config, redis_url=None):
+    app = web.Application()
+    app["config"] = config
+    if redis_url:
+        class RedisClient:
+            @staticmethod
+            def get_redis_instance():
+                return Redis.from_url(redis_url)
+        app_setup.handlers.redis_client = RedisClient
+    else:
+        app_setup.handlers.redis_client = mock_redis_client
+    app.cleanup_ctx.append(app_setup.handlers.redis_context)
+    app_setup.setup_routes(app)
+    return app
+
+
+async def run_load_test(config, trace, concurrency=10, prefill=0, redis_url=None):
+    """
+    Replays a trace against the app and measures the latency of each request.
+
+    :param config: A dict containing the apps configuration
+    :param trace: A list of request dicts to replay
+    :param concurrency: The number of requests in flight at any time
+    :param prefill: The number of jobs to enqueue before the measured run starts
+    :param redis_url: If given, connect to this Redis instead of using fakeredis
+    :returns A report dict, see summarize()
+    """
+    # jobs should stay in the queue rather than being executed in-process
+    config = dict(config, async_redis=True)
+    app = create_app(config, redis_url)
+    server = TestServer(app)
+    await server.start_server()
+
+    base_url = config["base_url"]
+    job_ids = []
+    latencies = {}
+    statuses = {}
+    requests = iter(trace)
+
+    async def send(session, request):
+        path = request["path"]
+        if "{job_id}" in path:
+            path = path.replace("{job_id}", random.choice(job_ids) if job_ids else "unknown")
+        start = time.perf_counter()
+        async with session.request(
+                request["method"], server.make_url(base_url + path),
+                json=request.get("body")) as resp:
+            await resp.read()
+        latency = time.perf_counter() - start
+        # errors raised in the handlers are returned as text/plain by aiohttp
+        if resp.status == 200 and resp.content_type == "application/json":
+            body = await resp.json()
+            if "job_id" in body:
+                job_ids.append(body["job_id"])
+        return path.split("/")[1], resp.status, latency
+
+    async def client(session):
+        for request in requests:
+            endpoint, code, latency = await send(session, request)
+            latencies.setdefault(endpoint, []).append(latency)
+            endpoint_statuses = statuses.setdefault(endpoint, {})
+            endpoint_statuses[code] = endpoint_statuses.get(code, 0) + 1
+
+    try:
+        async with ClientSession() as session:
+            for request in synthetic_trace(prefill, verify_ratio=1):
+                await send(session, request)
+
+            start = time.perf_counter()
+            await asyncio.gather(*[client(session) for _ in range(concurrency)])
+            elapsed = time.perf_counter() - start
+    finally:
+        # remove the enqueued jobs so that no worker listening on the queue picks them up
+        q = app["redis_q"]
+        for job_id in job_ids:
+            job = q.fetch_job(job_id)
+            if job is not None:
+                job.delete()
+        await server.close()
+
+    return summarize(latencies, statuses, elapsed)
+
+
+def format_report(report):
+    lines = [
+        f"{'endpoint':<10} {'requests':>9} {'req/s':>9} {'p50 ms':>8} {'p90 ms':>8} "
+        f"{'p99 ms':>8} {'max ms':>8}  statuses"]
+    for endpoint, r in report.items():
+        codes = ", ".join(f"{code}: {n}" for code, n in sorted(r["statuses"].items()))
+        lines.append(
+            f"{endpoint:<10} {r['requests']:>9} {r['throughput']:>9.1f} {r['p50_ms']:>8.2f} "
+            f"{r['p90_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['max_ms']:>8.2f}  {codes}")
+    lines.append(f"elapsed: {report['total']['elapsed_s']:.2f}s")
+    return "\n".join(lines)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load test the archive-verify REST API")
+    parser.add_argument("-c", "--config", help="Path to app config file", type=str,
+                        default="tests/test_config.yaml")
+    parser.add_argument("-t", "--trace", help="JSONL file with requests to replay", type=str)
+    parser.add_argument("-n", "--requests", help="Number of synthetic requests to send", type=int,
+                        default=1000)
+    parser.add_argument("--verify-ratio", help="Fraction of synthetic requests going to /verify",
+                        type=float, default=0.1)
+    parser.add_argument("--concurrency", help="Number of concurrent clients", type=int, default=10)
+    parser.add_argument("--prefill", help="Number of jobs to enqueue before measuring", type=int,
+                        default=0)
+    parser.add_argument("--redis-url", help="Use this Redis instead of fakeredis", type=str)
+    parser.add_argument("--allow-real-redis", action="store_true",
+                        help="Required with --redis-url; verify jobs are enqueued on the default "
+                             "queue of that Redis, where a running worker would execute them")
+    parser.add_argument("--json", help="Print the report as JSON", action="store_true")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.redis_url and not args.allow_real_redis:
+        sys.exit("--redis-url enqueues real verify jobs, pass --allow-real-redis if no worker "
+                 "is listening on that Redis")
+    with open(args.config) as config:
+        conf = yaml.safe_load(config)
+    trace = load_trace(args.trace) if args.trace else synthetic_trace(
+        args.requests, args.verify_ratio)
+    report = asyncio.run(run_load_test(
+        conf, trace,
+        concurrency=args.concurrency,
+        prefill=args.prefill,
+        redis_url=args.redis_url))
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
+
+
+if __name__ == "__main__":
+    main()
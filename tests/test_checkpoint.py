@@ -0,0 +1,112 @@
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock as mock
+
+from archive_verify.checkpoint import Checkpoint
+
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dest_root = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_create_and_load(self):
+        checkpoint = Checkpoint.create(
+            os.path.join(self.dest_root, "archive_1234"), "archive", "descr", "1234")
+        checkpoint.mark_verified("a")
+        checkpoint.mark_verified("dir/b")
+
+        loaded = Checkpoint.load(checkpoint.path)
+        self.assertEqual(loaded.job_id, "1234")
+        self.assertEqual(loaded.verified, {"a", "dir/b"})
+        self.assertFalse(loaded.completed)
+
+        checkpoint.mark_completed()
+        self.assertTrue(Checkpoint.load(checkpoint.path).completed)
+
+    def test_load_truncated(self):
+        checkpoint = Checkpoint.create(
+            os.path.join(self.dest_root, "archive_1234"), "archive", "descr", "1234")
+        checkpoint.mark_verified("a")
+        with open(checkpoint.path, "a") as fh:
+            fh.write('{"event": "verif')
+        self.assertEqual(Checkpoint.load(checkpoint.path).verified, {"a"})
+
+        with open(checkpoint.path, "w") as fh:
+            fh.write("garbage")
+        self.assertIsNone(Checkpoint.load(checkpoint.path))
+
+    def test_find(self):
+        self.assertIsNone(Checkpoint.find(self.dest_root, "archive", "descr"))
+
+        checkpoints = [
+            Checkpoint.create(os.path.join(self.dest_root, "archive_1"), "archive", "other", "1"),
+            Checkpoint.create(os.path.join(self.dest_root, "archive_2"), "archive", "descr", "2"),
+            Checkpoint.create(os.path.join(self.dest_root, "archive_3"), "archive", "descr", "3"),
+            Checkpoint.create(os.path.join(self.dest_root, "archive2_4"), "archive2", "descr", "4")]
+        checkpoints[2].mark_completed()
+        for checkpoint in checkpoints:
+            checkpoint.release()
+
+        found = Checkpoint.find(self.dest_root, "archive", "descr")
+        self.assertEqual(found.job_id, "2")
+        # a checkpoint held by another job is not found again
+        self.assertIsNone(Checkpoint.find(self.dest_root, "archive", "descr"))
+        found.release()
+
+        self.assertEqual(Checkpoint.find(self.dest_root, "archive", "other").job_id, "1")
+        self.assertIsNone(Checkpoint.find(self.dest_root, "archive", "unknown"))
+
+    def test_find_skips_active_owner(self):
+        checkpoint = Checkpoint.create(
+            os.path.join(self.dest_root, "archive_1"), "archive", "descr", "1")
+        checkpoint.mark_resumed("2")
+        checkpoint.release()
+
+        self.assertIsNone(
+            Checkpoint.find(self.dest_root, "archive", "descr", is_active=lambda job_id: job_id == "2"))
+        found = Checkpoint.find(
+            self.dest_root, "archive", "descr", is_active=lambda job_id: job_id == "1")
+        self.assertEqual(found.owner, "2")
+
+    def test_resumed_job_link(self):
+        dest = os.path.join(self.dest_root, "archive_1")
+        checkpoint = Checkpoint.create(dest, "archive", "descr", "1")
+        checkpoint.mark_resumed("2")
+        link = os.path.join(self.dest_root, "archive_2")
+        self.assertEqual(os.path.realpath(link), os.path.realpath(dest))
+        checkpoint.release()
+
+        # the checkpoint is found once, through its own directory
+        found = Checkpoint.find(self.dest_root, "archive", "descr")
+        self.assertEqual(found.path, checkpoint.path)
+        found.release()
+
+        checkpoint.remove_links()
+        self.assertFalse(os.path.lexists(link))
+
+    def test_find_skips_removed_checkpoint(self):
+        for job_id in ["1", "2"]:
+            Checkpoint.create(
+                os.path.join(self.dest_root, f"archive_{job_id}"), "archive", "descr", job_id).release()
+        getmtime = os.path.getmtime
+
+        def removed(path):
+            if "archive_2" in path:
+                raise FileNotFoundError(path)
+            return getmtime(path)
+
+        with mock.patch("os.path.getmtime", side_effect=removed):
+            self.assertEqual(Checkpoint.find(self.dest_root, "archive", "descr").job_id, "1")
+
+    def test_lock_removed_checkpoint(self):
+        dest = os.path.join(self.dest_root, "archive_1")
+        checkpoint = Checkpoint.create(dest, "archive", "descr", "1")
+        checkpoint.release()
+        shutil.rmtree(dest)
+        self.assertFalse(checkpoint.lock())
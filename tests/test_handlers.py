@@ -1,10 +1,16 @@
+import asyncio
+import os
+import tempfile
 import yaml
 
 from aiohttp.test_utils import AioHTTPTestCase
 from aiohttp import web
+from rq import Queue
 
 import archive_verify.app as app_setup
 import archive_verify.pdc_client
+from archive_verify.checkpoint import Checkpoint
+from archive_verify.results import index_md5sum_output
 import mock_redis_client
 import unittest.mock as mock
 
@@ -100,3 +106,121 @@ class HandlerTestCase(AioHTTPTestCase):
             resp = await request.json()
             assert resp["state"] == "error"
             assert "failed to properly download archive from pdc" in resp["msg"]
+
+    def enqueue_pending_job(self):
+        # the app's queue runs jobs immediately, so enqueue on an asynchronous queue instead
+        q = Queue(connection=self.app["redis_q"].connection, is_async=True)
+        return q.enqueue(print)
+
+    async def test_status_etag(self):
+        job = self.enqueue_pending_job()
+        url = self.BASE_URL + "/status/" + job.id
+
+        request = await self.client.request("GET", url)
+        assert request.status == 200
+        resp = await request.json()
+        assert resp["state"] == "pending"
+        etag = request.headers["ETag"]
+
+        request = await self.client.request("GET", url, headers={"If-None-Match": etag})
+        assert request.status == 304
+
+        request = await self.client.request("GET", url, headers={"If-None-Match": '"other"'})
+        assert request.status == 200
+
+        for if_none_match in [f'"other", W/{etag}', "*"]:
+            request = await self.client.request(
+                "GET", url, headers={"If-None-Match": if_none_match})
+            assert request.status == 304
+
+        # the etag changes with the status
+        job.set_status("started")
+        request = await self.client.request("GET", url, headers={"If-None-Match": etag})
+        assert request.status == 200
+        resp = await request.json()
+        assert resp["state"] == "started"
+        assert request.headers["ETag"] != etag
+
+    async def test_status_long_poll(self):
+        self.app["config"]["status_poll_interval"] = 0.01
+        job = self.enqueue_pending_job()
+        url = self.BASE_URL + "/status/" + job.id
+
+        # times out without a change
+        request = await self.client.request("GET", url, params={"wait": "0.05"})
+        assert request.status == 200
+        resp = await request.json()
+        assert resp["state"] == "pending"
+        etag = request.headers["ETag"]
+
+        request = await self.client.request(
+            "GET", url, params={"wait": "0.05"}, headers={"If-None-Match": etag})
+        assert request.status == 304
+
+        # returns as soon as the status changes
+        async def start_job():
+            await asyncio.sleep(0.05)
+            job.set_status("started")
+
+        starter = asyncio.create_task(start_job())
+        request = await self.client.request(
+            "GET", url, params={"wait": "10"}, headers={"If-None-Match": etag})
+        await starter
+        assert request.status == 200
+        resp = await request.json()
+        assert resp["state"] == "started"
+
+        request = await self.client.request("GET", url, params={"wait": "foo"})
+        assert request.status == 400
+
+    async def test_results_wrong_id(self):
+        url = self.BASE_URL + "/results/foobar"
+        request = await self.client.request("GET", url)
+        assert request.status == 404
+        resp = await request.json()
+        assert "no verification results found for job foobar" in resp["msg"].lower()
+
+    async def test_results(self):
+        with tempfile.TemporaryDirectory() as verify_root_dir:
+            self.app["config"]["verify_root_dir"] = verify_root_dir
+            dest = os.path.join(verify_root_dir, "test_archive_1234")
+            os.mkdir(dest)
+            md5_output = os.path.join(dest, "compare_md5sum.out")
+            with open(md5_output, "w") as fh:
+                fh.write("./a: OK\n./b: FAILED\n./c: FAILED\n")
+            index_md5sum_output(md5_output, os.path.join(dest, "compare_md5sum.db"))
+
+            url = self.BASE_URL + "/results/1234"
+            request = await self.client.request(
+                "GET", url, params={"status": "FAILED", "limit": "1"})
+            assert request.status == 200
+            resp = await request.json()
+            assert resp["counts"] == {"FAILED": 2, "OK": 1}
+            assert resp["results"] == [{"path": "b", "status": "FAILED", "detail": ""}]
+            assert resp["next"] == "b"
+
+            request = await self.client.request(
+                "GET", url, params={"status": "FAILED", "after": resp["next"]})
+            resp = await request.json()
+            assert resp["results"] == [{"path": "c", "status": "FAILED", "detail": ""}]
+            assert resp["next"] is None
+
+            request = await self.client.request("GET", url, params={"limit": "foo"})
+            assert request.status == 400
+
+    async def test_results_resumed_job(self):
+        with tempfile.TemporaryDirectory() as verify_root_dir:
+            self.app["config"]["verify_root_dir"] = verify_root_dir
+            dest = os.path.join(verify_root_dir, "test_archive_old-job")
+            checkpoint = Checkpoint.create(dest, "test_archive", "test-description", "old-job")
+            checkpoint.mark_resumed("new-job")
+            checkpoint.release()
+            md5_output = os.path.join(dest, "compare_md5sum.out")
+            with open(md5_output, "w") as fh:
+                fh.write("./a: OK\n")
+            index_md5sum_output(md5_output, os.path.join(dest, "compare_md5sum.db"))
+
+            request = await self.client.request("GET", self.BASE_URL + "/results/new-job")
+            assert request.status == 200
+            resp = await request.json()
+            assert resp["counts"] == {"OK": 1}
@@ -0,0 +1,50 @@
+import asyncio
+import unittest
+from unittest import mock
+import yaml
+
+import loadtest
+
+
+class TestLoadTest(unittest.TestCase):
+    def setUp(self):
+        with open("tests/test_config.yaml") as config:
+            self.config = yaml.safe_load(config)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(loadtest.percentile(values, 50), 50)
+        self.assertEqual(loadtest.percentile(values, 99), 99)
+        self.assertEqual(loadtest.percentile(values, 100), 100)
+        self.assertEqual(loadtest.percentile([3], 0), 3)
+
+    def test_replay_trace(self):
+        trace = loadtest.synthetic_trace(50, verify_ratio=0.2)
+        trace.append({"method": "GET", "path": "/status/unknown"})
+        # a body missing "archive" makes the handler fail with a text/plain 500
+        trace.append({"method": "POST", "path": "/verify", "body": {"host": "h", "description": "d"}})
+        report = asyncio.run(loadtest.run_load_test(self.config, trace, concurrency=5, prefill=5))
+
+        self.assertEqual(report["total"]["requests"], 52)
+        self.assertEqual(
+            report["verify"]["requests"] + report["status"]["requests"], 52)
+        self.assertEqual(report["status"]["statuses"][400], 1)
+        self.assertEqual(report["verify"]["statuses"][500], 1)
+        self.assertEqual(report["total"]["statuses"][200], 50)
+        self.assertGreater(report["total"]["throughput"], 0)
+
+    def test_jobs_are_removed(self):
+        apps = []
+        wrapped = loadtest.create_app
+
+        def create_app(config, redis_url=None):
+            apps.append(wrapped(config, redis_url))
+            return apps[-1]
+
+        trace = loadtest.synthetic_trace(10, verify_ratio=1)
+        with mock.patch.object(loadtest, "create_app", create_app):
+            report = asyncio.run(loadtest.run_load_test(self.config, trace, concurrency=2, prefill=3))
+
+        self.assertEqual(report["verify"]["statuses"][200], 10)
+        q = apps[0]["redis_q"]
+        self.assertEqual(q.count, 0)
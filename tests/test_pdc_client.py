@@ -46,6 +46,14 @@ class TestPdcClient(unittest.TestCase):
         ret = self.getPdcClient().download()
         self.assertEqual(ret, True)
 
+    @mock.patch('subprocess.Popen')
+    def test_download_from_pdc_io_priority(self, mock_popen):
+        mock_popen.return_value.returncode = 0
+        mock_popen.return_value.communicate.return_value = ("foobar", '')
+        self.config["io_limits"] = {"ionice_class": 3}
+        self.getPdcClient().download()
+        self.assertIn("ionice -c 3 dsmc retr", mock_popen.call_args[0][0])
+
     # Check when dsmc returns != 0
     def test_download_from_pdc_with_ok_warning(self):
         exp_ret = "33232"
@@ -0,0 +1,98 @@
+import os
+import tempfile
+import unittest
+
+from archive_verify.results import index_md5sum_output, parse_md5sum_line, query_results
+
+MD5SUM_OUTPUT = """./runfolder/a.fastq.gz: OK
+./runfolder/b.fastq.gz: FAILED
+./runfolder/sub/c.txt: OK
+./other/d.txt: FAILED open or read
+md5sum: ./other/d.txt: No such file or directory
+md5sum: WARNING: 1 listed file could not be read
+md5sum: WARNING: 1 computed checksum did NOT match
+"""
+
+
+class TestResults(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.md5_output = os.path.join(self.tmp_dir.name, "compare_md5sum.out")
+        self.db_path = os.path.join(self.tmp_dir.name, "compare_md5sum.db")
+        with open(self.md5_output, "w") as fh:
+            fh.write(MD5SUM_OUTPUT)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_parse_md5sum_line(self):
+        self.assertEqual(parse_md5sum_line("./dir/file: OK\n"), ("dir/file", "OK", ""))
+        self.assertEqual(parse_md5sum_line("dir/file: FAILED\n"), ("dir/file", "FAILED", ""))
+        self.assertEqual(
+            parse_md5sum_line("./file: FAILED open or read"), ("file", "FAILED", "open or read"))
+        self.assertEqual(parse_md5sum_line("md5sum: WARNING: 1 listed file could not be read"), None)
+        self.assertEqual(parse_md5sum_line("\n"), None)
+
+    def test_index_md5sum_output(self):
+        counts = index_md5sum_output(self.md5_output, self.db_path)
+        self.assertEqual(counts, {"OK": 2, "FAILED": 2})
+
+        # indexing again replaces the existing database
+        counts = index_md5sum_output(self.md5_output, self.db_path)
+        self.assertEqual(counts, {"OK": 2, "FAILED": 2})
+
+    def test_index_md5sum_output_invalid_utf8(self):
+        with open(self.md5_output, "wb") as fh:
+            fh.write(b"./caf\xe9: OK\n./b: FAILED\n")
+        counts = index_md5sum_output(self.md5_output, self.db_path)
+        self.assertEqual(counts, {"OK": 1, "FAILED": 1})
+
+        _, results, _ = query_results(self.db_path, status="OK")
+        self.assertEqual(results[0]["path"], "caf\\xe9")
+
+    def test_query_results_filters(self):
+        index_md5sum_output(self.md5_output, self.db_path)
+
+        counts, results, next_cursor = query_results(self.db_path, status="FAILED")
+        self.assertEqual(counts["FAILED"], 2)
+        self.assertEqual(
+            results,
+            [
+                {"path": "other/d.txt", "status": "FAILED", "detail": "open or read"},
+                {"path": "runfolder/b.fastq.gz", "status": "FAILED", "detail": ""}
+            ])
+        self.assertIsNone(next_cursor)
+
+        _, results, _ = query_results(self.db_path, prefix="runfolder/")
+        self.assertEqual(
+            [r["path"] for r in results],
+            ["runfolder/a.fastq.gz", "runfolder/b.fastq.gz", "runfolder/sub/c.txt"])
+
+        _, results, _ = query_results(self.db_path, status="OK", prefix="runfolder/sub")
+        self.assertEqual([r["path"] for r in results], ["runfolder/sub/c.txt"])
+
+    def test_query_results_paging(self):
+        index_md5sum_output(self.md5_output, self.db_path)
+
+        paths = []
+        after = None
+        while True:
+            _, results, after = query_results(self.db_path, after=after, limit=3)
+            paths.extend([r["path"] for r in results])
+            if after is None:
+                break
+        self.assertEqual(
+            paths,
+            ["other/d.txt", "runfolder/a.fastq.gz", "runfolder/b.fastq.gz", "runfolder/sub/c.txt"])
+
+    def test_query_results_prefix_edge_cases(self):
+        with open(self.md5_output, "w") as fh:
+            fh.write("./a\U0010ffff/x: OK\n./a\ud7ff/y: OK\n./b: OK\n")
+        index_md5sum_output(self.md5_output, self.db_path)
+
+        _, results, _ = query_results(self.db_path, prefix="a\U0010ffff")
+        self.assertEqual([r["path"] for r in results], ["a\U0010ffff/x"])
+        _, results, _ = query_results(self.db_path, prefix="a\ud7ff")
+        self.assertEqual([r["path"] for r in results], ["a\ud7ff/y"])
+        _, results, _ = query_results(self.db_path, prefix="\U0010ffff")
+        self.assertEqual(results, [])
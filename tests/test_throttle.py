@@ -0,0 +1,78 @@
+import datetime
+import unittest
+
+import fakeredis
+
+from archive_verify.throttle import (
+    RedisTokenBucket, TokenBucket, command_prefix, is_active, throttle_from_config)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class TestThrottle(unittest.TestCase):
+    def test_is_active(self):
+        day = datetime.datetime(2024, 1, 1, 12)
+        night = datetime.datetime(2024, 1, 1, 23)
+        self.assertTrue(is_active({}, day))
+        self.assertTrue(is_active({"active_hours": [8, 20]}, day))
+        self.assertFalse(is_active({"active_hours": [8, 20]}, night))
+        self.assertTrue(is_active({"active_hours": [22, 6]}, night))
+        self.assertFalse(is_active({"active_hours": [22, 6]}, day))
+
+    def test_command_prefix(self):
+        day = datetime.datetime(2024, 1, 1, 12)
+        night = datetime.datetime(2024, 1, 1, 23)
+        self.assertEqual(command_prefix({}, day), "")
+        io_limits = {"ionice_class": 2, "ionice_level": 7, "nice": 10, "active_hours": [8, 20]}
+        self.assertEqual(command_prefix(io_limits, day), "ionice -c 2 -n 7 nice -n 10 ")
+        self.assertEqual(command_prefix(io_limits, night), "")
+        self.assertEqual(command_prefix({"ionice_class": 3}, day), "ionice -c 3 ")
+
+    def test_token_bucket(self):
+        clock = FakeClock()
+        bucket = TokenBucket(100, clock=clock, sleep=clock.sleep)
+
+        # the initial burst is free
+        bucket.consume(100)
+        self.assertEqual(clock.slept, [])
+
+        # then the deficit is slept off
+        bucket.consume(50)
+        self.assertEqual(clock.slept, [0.5])
+        bucket.consume(100)
+        self.assertEqual(clock.slept, [0.5, 1.0])
+
+        # tokens accumulate while idle, up to the burst
+        clock.now += 10
+        bucket.consume(100)
+        self.assertEqual(clock.slept, [0.5, 1.0])
+
+    def test_redis_token_bucket_is_shared(self):
+        connection = fakeredis.FakeStrictRedis()
+        clock = FakeClock()
+        buckets = [
+            RedisTokenBucket(connection, "io:node", 100, clock=clock, sleep=clock.sleep)
+            for _ in range(2)]
+
+        buckets[0].consume(100)
+        self.assertEqual(clock.slept, [])
+        buckets[1].consume(100)
+        self.assertEqual(clock.slept, [1.0])
+
+    def test_throttle_from_config(self):
+        self.assertIsNone(throttle_from_config({"nice": 10}))
+        throttle = throttle_from_config(
+            {"hash_bytes_per_sec": 100, "node_bytes_per_sec": 200}, fakeredis.FakeStrictRedis())
+        self.assertEqual([b.rate for b in throttle.buckets], [100, 200])
+        self.assertIsInstance(throttle.buckets[1], RedisTokenBucket)
@@ -1,9 +1,16 @@
 import copy
+import json
+import logging
+import os
+import subprocess
+import tempfile
 import unittest
 import unittest.mock as mock
 import yaml
 
-from archive_verify.workers import compare_md5sum, pdc_client_factory, verify_archive
+from archive_verify.checkpoint import Checkpoint
+from archive_verify.throttle import throttle_from_config
+from archive_verify.workers import compare_md5sum, configure_log, log, pdc_client_factory, verify_archive
 
 
 class TestWorkers(unittest.TestCase):
@@ -31,16 +38,191 @@ class TestWorkers(unittest.TestCase):
     @mock.patch('subprocess.Popen')
     def test_compare_md5sum_ok(self, mock_popen): 
         mock_popen.return_value.returncode = 0 
-        ret = compare_md5sum("archive-dir")
+        with tempfile.TemporaryDirectory() as dest:
+            ret = compare_md5sum(os.path.join(dest, "archive-dir"))
         self.assertEqual(ret, True)
 
     # Check with failing checksums
     @mock.patch('subprocess.Popen')
     def test_compare_md5sum_not_ok(self, mock_popen): 
         mock_popen.return_value.returncode = 42
-        ret = compare_md5sum("archive-dir")
+        with tempfile.TemporaryDirectory() as dest:
+            ret = compare_md5sum(os.path.join(dest, "archive-dir"))
         self.assertEqual(ret, False)
 
+    def test_compare_md5sum_kills_md5sum_on_error(self):
+        processes = []
+        popen = subprocess.Popen
+
+        def start(*args, **kwargs):
+            processes.append(popen(*args, **kwargs))
+            return processes[-1]
+
+        with tempfile.TemporaryDirectory() as dest:
+            archive_dir = os.path.join(dest, "my-archive")
+            os.mkdir(archive_dir)
+            with open(os.path.join(archive_dir, "a"), "w") as fh:
+                fh.write("foo")
+            with open(os.path.join(archive_dir, "checksums_prior_to_pdc.md5"), "w") as fh:
+                fh.write("acbd18db4cc2f85cedef654fccc4a4d8  ./a\n")
+
+            checkpoint = mock.Mock(verified=set())
+            checkpoint.mark_verified.side_effect = RuntimeError("disk full")
+            with mock.patch("subprocess.Popen", side_effect=start), \
+                    self.assertRaises(RuntimeError):
+                compare_md5sum(archive_dir, checkpoint)
+        self.assertEqual(len(processes), 1)
+        self.assertIsNotNone(processes[0].returncode)
+
+    def test_compare_md5sum_resume(self):
+        with tempfile.TemporaryDirectory() as dest:
+            archive_dir = os.path.join(dest, "my-archive")
+            os.mkdir(archive_dir)
+            for name, content in [("a", "foo"), ("b", "bar"), ("c", "baz")]:
+                with open(os.path.join(archive_dir, name), "w") as fh:
+                    fh.write(content)
+            with open(os.path.join(archive_dir, "checksums_prior_to_pdc.md5"), "w") as fh:
+                fh.write(
+                    "acbd18db4cc2f85cedef654fccc4a4d8  ./a\n"
+                    "37b51d194a7513e45b56f6524f2d51f2  ./b\n"
+                    "00000000000000000000000000000000  ./c\n")
+
+            checkpoint = Checkpoint.create(dest, "my-archive", "my-descr", "1234")
+            checkpoint.mark_verified("a")
+            self.assertFalse(compare_md5sum(archive_dir, checkpoint))
+
+            with open(os.path.join(dest, "compare_md5sum.out")) as fh:
+                self.assertEqual(fh.read(), "./a: OK\n./b: OK\n./c: FAILED\n")
+            with open(os.path.join(dest, "checksums_remaining.md5")) as fh:
+                self.assertNotIn("./a", fh.read())
+            self.assertEqual(Checkpoint.load(checkpoint.path).verified, {"a", "b"})
+
+    def test_compare_md5sum_resume_all_verified(self):
+        with tempfile.TemporaryDirectory() as dest:
+            archive_dir = os.path.join(dest, "my-archive")
+            os.mkdir(archive_dir)
+            with open(os.path.join(archive_dir, "a"), "w") as fh:
+                fh.write("foo")
+            with open(os.path.join(archive_dir, "checksums_prior_to_pdc.md5"), "w") as fh:
+                fh.write("acbd18db4cc2f85cedef654fccc4a4d8  ./a\n")
+
+            checkpoint = Checkpoint.create(dest, "my-archive", "my-descr", "1234")
+            checkpoint.mark_verified("a")
+            self.assertTrue(compare_md5sum(archive_dir, checkpoint))
+            with open(os.path.join(dest, "compare_md5sum.out")) as fh:
+                self.assertEqual(fh.read(), "./a: OK\n")
+
+    def test_compare_md5sum_invalid_utf8(self):
+        with tempfile.TemporaryDirectory() as dest:
+            archive_dir = os.path.join(dest, "my-archive")
+            os.mkdir(archive_dir)
+            with open(os.path.join(archive_dir.encode(), b"caf\xe9"), "w") as fh:
+                fh.write("foo")
+            with open(os.path.join(archive_dir, "checksums_prior_to_pdc.md5"), "wb") as fh:
+                fh.write(b"acbd18db4cc2f85cedef654fccc4a4d8  ./caf\xe9\n")
+
+            checkpoint = Checkpoint.create(dest, "my-archive", "my-descr", "1234")
+            self.assertTrue(compare_md5sum(archive_dir, checkpoint))
+            with open(os.path.join(dest, "compare_md5sum.out"), "rb") as fh:
+                self.assertEqual(fh.read(), b"./caf\xe9: OK\n")
+
+            # the file is skipped when resuming
+            checkpoint = Checkpoint.load(checkpoint.path)
+            self.assertEqual(len(checkpoint.verified), 1)
+            self.assertTrue(compare_md5sum(archive_dir, checkpoint))
+            with open(os.path.join(dest, "compare_md5sum.out"), "rb") as fh:
+                self.assertEqual(fh.read(), b"./caf\xe9: OK\n")
+
+    def test_compare_md5sum_throttled(self):
+        with tempfile.TemporaryDirectory() as dest:
+            archive_dir = os.path.join(dest, "my-archive")
+            os.mkdir(archive_dir)
+            for name, content in [("a", "foo"), ("b", "bar")]:
+                with open(os.path.join(archive_dir, name), "w") as fh:
+                    fh.write(content)
+            with open(os.path.join(archive_dir, "checksums_prior_to_pdc.md5"), "w") as fh:
+                fh.write(
+                    "acbd18db4cc2f85cedef654fccc4a4d8  ./a\n"
+                    "00000000000000000000000000000000  ./b\n"
+                    "00000000000000000000000000000000  ./c\n")
+
+            throttle = throttle_from_config({"hash_bytes_per_sec": 1024 * 1024})
+            with mock.patch.object(throttle, "consume", wraps=throttle.consume) as mock_consume:
+                self.assertFalse(compare_md5sum(archive_dir, throttle=throttle))
+                self.assertEqual(mock_consume.call_count, 2)
+            with open(os.path.join(dest, "compare_md5sum.out")) as fh:
+                self.assertEqual(
+                    fh.read(), "./a: OK\n./b: FAILED\n./c: FAILED open or read\n")
+
+            with open(os.path.join(archive_dir, "checksums_prior_to_pdc.md5"), "w") as fh:
+                fh.write("acbd18db4cc2f85cedef654fccc4a4d8  ./a\nnot a checksum\n")
+            with self.assertLogs(log, "WARNING") as logs:
+                self.assertTrue(compare_md5sum(archive_dir, throttle=throttle))
+            self.assertIn("1 line(s) improperly formatted", logs.output[0])
+
+    def test_compare_md5sum_throttled_no_checksums(self):
+        throttle = throttle_from_config({"hash_bytes_per_sec": 1024 * 1024})
+        for content in ["", "not a checksum\n"]:
+            with tempfile.TemporaryDirectory() as dest:
+                archive_dir = os.path.join(dest, "my-archive")
+                os.mkdir(archive_dir)
+                with open(os.path.join(archive_dir, "checksums_prior_to_pdc.md5"), "w") as fh:
+                    fh.write(content)
+                with self.assertLogs(log, "WARNING") as logs:
+                    self.assertFalse(compare_md5sum(archive_dir, throttle=throttle))
+                self.assertIn("no properly formatted MD5 checksum lines found", logs.output[-1])
+
+    def test_verify_archive_resume(self):
+        with tempfile.TemporaryDirectory() as verify_root_dir, \
+                mock.patch('archive_verify.pdc_client.PdcClient.download') as mock_download, \
+                mock.patch('rq.get_current_job') as mock_job, \
+                mock.patch('archive_verify.workers.compare_md5sum') as mock_md5sum:
+            config = copy.copy(self.config)
+            config["verify_root_dir"] = verify_root_dir
+            config["resume_from_checkpoint"] = True
+            archive = "my-archive"
+            old_dest = os.path.join(verify_root_dir, f"{archive}_old-job")
+            Checkpoint.create(old_dest, archive, "my-descr", "old-job")
+            mock_job.return_value.id = "new-job"
+            mock_md5sum.return_value = False
+
+            with mock.patch('archive_verify.workers._job_is_active') as mock_active:
+                mock_active.return_value = False
+                ret = verify_archive(archive, "my-host", "my-descr", False, config)
+                mock_active.assert_called_with("old-job", mock_job.return_value.connection)
+            mock_download.assert_not_called()
+            self.assertEqual(ret["state"], "error")
+            self.assertEqual(ret["path"], f"{old_dest}/compare_md5sum.out")
+            checkpoint = mock_md5sum.call_args[0][1]
+            self.assertEqual(checkpoint.job_id, "old-job")
+            checkpoint = Checkpoint.load(checkpoint.path)
+            self.assertTrue(checkpoint.completed)
+            self.assertEqual(checkpoint.job_ids, ["old-job", "new-job"])
+
+            # a completed checkpoint is not resumed
+            mock_download.return_value = False
+            ret = verify_archive(archive, "my-host", "my-descr", False, config)
+            mock_download.assert_called_once()
+            self.assertIn("new-job", ret["path"])
+
+    def test_verify_archive_no_resume_of_active_job(self):
+        with tempfile.TemporaryDirectory() as verify_root_dir, \
+                mock.patch('archive_verify.pdc_client.PdcClient.download') as mock_download, \
+                mock.patch('rq.get_current_job') as mock_job, \
+                mock.patch('archive_verify.workers._job_is_active') as mock_active:
+            config = copy.copy(self.config)
+            config["verify_root_dir"] = verify_root_dir
+            config["resume_from_checkpoint"] = True
+            Checkpoint.create(
+                os.path.join(verify_root_dir, "my-archive_old-job"), "my-archive", "my-descr", "old-job")
+            mock_job.return_value.id = "new-job"
+            mock_active.return_value = True
+            mock_download.return_value = False
+
+            ret = verify_archive("my-archive", "my-host", "my-descr", False, config)
+            mock_download.assert_called_once()
+            self.assertIn("new-job", ret["path"])
+
     def test_verify_archive_download_not_ok(self): 
         with mock.patch('archive_verify.pdc_client.PdcClient.download') as mock_download, \
                 mock.patch('rq.get_current_job') as mock_job:
@@ -87,3 +269,51 @@ class TestWorkers(unittest.TestCase):
             self.assertEqual(ret["state"], "done")
             self.assertEqual(archive in ret["path"] and job_id in ret["path"], True)
             mock_cleanup.assert_not_called()
+
+    def test_configure_log_removes_handler(self):
+        with tempfile.TemporaryDirectory() as log_dir:
+            handlers = list(log.handlers)
+            with configure_log(log_dir, "my-descr"):
+                self.assertEqual(len(log.handlers), len(handlers) + 1)
+                log.info("inside job")
+            self.assertEqual(log.handlers, handlers)
+            log.info("outside job")
+
+            log_files = os.listdir(log_dir)
+            self.assertEqual(len(log_files), 1)
+            with open(os.path.join(log_dir, log_files[0])) as fh:
+                lines = fh.readlines()
+            self.assertEqual(len(lines), 1)
+            self.assertTrue(lines[0].rstrip().endswith("INFO - inside job"))
+
+    def test_configure_log_json(self):
+        with tempfile.TemporaryDirectory() as log_dir:
+            with configure_log(log_dir, "my-descr", log_format="json", queue_size=1):
+                for i in range(10):
+                    log.warning(f"message {i}")
+
+            log_file = os.path.join(log_dir, os.listdir(log_dir)[0])
+            with open(log_file) as fh:
+                entries = [json.loads(line) for line in fh]
+            self.assertEqual([e["message"] for e in entries], [f"message {i}" for i in range(10)])
+            self.assertEqual(entries[0]["level"], logging.getLevelName(logging.WARNING))
+            self.assertEqual(entries[0]["name"], "archive_verify.workers")
+
+    def test_configure_log_exception(self):
+        for log_format in ["json", "text"]:
+            with tempfile.TemporaryDirectory() as log_dir:
+                with configure_log(log_dir, "my-descr", log_format=log_format):
+                    try:
+                        raise ValueError("boom")
+                    except ValueError:
+                        log.exception("failed %s", "here")
+
+                with open(os.path.join(log_dir, os.listdir(log_dir)[0])) as fh:
+                    content = fh.read()
+            if log_format == "json":
+                entry = json.loads(content)
+                self.assertEqual(entry["message"], "failed here")
+                self.assertIn("ValueError: boom", entry["exc_info"])
+            else:
+                self.assertIn("ERROR - failed here\nTraceback", content)
+                self.assertIn("ValueError: boom", content)